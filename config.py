@@ -14,3 +14,58 @@ class Config:
     
     SESSION_COOKIE_SECURE = False
     PERMANENT_SESSION_LIFETIME = timedelta(minutes=30)
+
+    # Caché de resultados de consultas (ver database/cache.py)
+    QUERY_CACHE_ENABLED = os.getenv("QUERY_CACHE_ENABLED", "1") == "1"
+    QUERY_CACHE_MAX_ENTRIES = int(os.getenv("QUERY_CACHE_MAX_ENTRIES", "256"))
+    QUERY_CACHE_TTL = int(os.getenv("QUERY_CACHE_TTL", "30"))
+
+    # Perfilado de peticiones (ver profiling.py); con ambos a 0 está desactivado
+    PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+    PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "0"))
+    PROFILE_SQL_SLOW_MS = float(os.getenv("PROFILE_SQL_SLOW_MS", "100"))
+    PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+    PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+
+    # Sincronización del catálogo: margen para transacciones aún sin confirmar
+    CHANGES_SAFETY_LAG_S = int(os.getenv("CHANGES_SAFETY_LAG_S", "5"))
+
+    # Listados en streaming: filas por lote del cursor y fragmentos de Jinja por envío
+    STREAM_FETCH_SIZE = int(os.getenv("STREAM_FETCH_SIZE", "200"))
+    STREAM_BUFFER_SIZE = int(os.getenv("STREAM_BUFFER_SIZE", "40"))
+    # Listados con como mucho estas filas se leen enteros y se cachean
+    STREAM_CACHE_MAX_ROWS = int(os.getenv("STREAM_CACHE_MAX_ROWS", "2000"))
+
+    # API JSON (/api/v1)
+    API_PAGE_SIZE = int(os.getenv("API_PAGE_SIZE", "100"))
+    API_MAX_PAGE_SIZE = int(os.getenv("API_MAX_PAGE_SIZE", "500"))
+    API_GZIP_MIN_BYTES = int(os.getenv("API_GZIP_MIN_BYTES", "1024"))
+    API_GZIP_LEVEL = int(os.getenv("API_GZIP_LEVEL", "5"))
+
+    # Archivado de préstamos devueltos (ver database/archive.py)
+    ARCHIVE_MIN_AGE_DAYS = int(os.getenv("ARCHIVE_MIN_AGE_DAYS", "365"))
+    ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "500"))
+    ARCHIVE_BATCH_PAUSE_S = float(os.getenv("ARCHIVE_BATCH_PAUSE_S", "1"))
+    ARCHIVE_INTERVAL_S = float(os.getenv("ARCHIVE_INTERVAL_S", "3600"))
+
+    # Trabajos en segundo plano (ver jobs.py)
+    JOBS_WORKERS = int(os.getenv("JOBS_WORKERS", "2"))
+    JOBS_MAX_PENDING = int(os.getenv("JOBS_MAX_PENDING", "20"))
+    JOBS_STALE_S = int(os.getenv("JOBS_STALE_S", "60"))
+    JOBS_HEARTBEAT_S = int(os.getenv("JOBS_HEARTBEAT_S", "10"))
+    JOBS_POLL_S = float(os.getenv("JOBS_POLL_S", "1"))
+    # Con el servidor de desarrollo el ejecutor corre dentro del propio proceso;
+    # gunicorn.conf.py lo desactiva y arranca un proceso ejecutor aparte
+    JOBS_EMBEDDED = os.getenv("JOBS_EMBEDDED", "1") == "1"
+    REPORTS_DIR = os.getenv("REPORTS_DIR", "reportes_generados")
+
+    # Servidor de producción (ver gunicorn.conf.py) y pool de conexiones por proceso
+    WEB_WORKER_CLASS = os.getenv("WEB_WORKER_CLASS", "gthread")
+    WEB_THREADS = int(os.getenv("WEB_THREADS", "4"))
+    WEB_WORKER_CONNECTIONS = int(os.getenv("WEB_WORKER_CONNECTIONS", "100"))
+    DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+    DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "0"))      # 0: se calcula con db_pool_size()
+    DB_POOL_GEVENT_MAX = int(os.getenv("DB_POOL_GEVENT_MAX", "10"))
+    # Espera máxima por una conexión libre; después la petición recibe un 503
+    DB_POOL_WAIT_TIMEOUT_MS = int(os.getenv("DB_POOL_WAIT_TIMEOUT_MS", "5000"))
+    DB_POOL_RETRY_AFTER_S = int(os.getenv("DB_POOL_RETRY_AFTER_S", "5"))
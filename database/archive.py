@@ -0,0 +1,64 @@
+import time
+import oracledb
+from database.cache import query_cache
+import logging
+
+logger = logging.getLogger(__name__)
+
+def archive_batch(conn, min_age_days, batch_size):
+    """Mueve a prestamos_historico un lote de préstamos DEVUELTO antiguos.
+
+    Solo archiva un proceso a la vez: el lote empieza bloqueando
+    prestamos_historico (que solo escribe el archivado) con NOWAIT; si otro
+    archivador lo tiene, no se hace nada. Las filas de prestamos se bloquean
+    con SKIP LOCKED, así que los préstamos nuevos nunca esperan. Devuelve
+    cuántas filas se movieron.
+    """
+    with conn.cursor() as cur:
+        try:
+            cur.execute("LOCK TABLE prestamos_historico IN EXCLUSIVE MODE NOWAIT")
+        except oracledb.DatabaseError as e:
+            if e.args[0].code != 54:    # ORA-00054: recurso ocupado
+                raise
+            logger.info("Otro proceso está archivando préstamos; se omite este ciclo")
+            return 0
+        cur.execute("""
+            SELECT id FROM prestamos
+            WHERE estado = 'DEVUELTO'
+              AND fecha_devolucion < SYSDATE - :dias
+              AND ROWNUM <= :lote
+            FOR UPDATE SKIP LOCKED
+        """, {"dias": min_age_days, "lote": batch_size})
+        ids = [{"id": r[0]} for r in cur.fetchall()]
+        if not ids:
+            conn.rollback()
+            return 0
+        cur.executemany("INSERT INTO prestamos_historico SELECT * FROM prestamos WHERE id = :id", ids)
+        cur.executemany("DELETE FROM prestamos WHERE id = :id", ids)
+    conn.commit()
+    query_cache.invalidate("prestamos", "prestamos_historico")
+    return len(ids)
+
+
+def archive_all(get_conn, min_age_days, batch_size, pause=0.0):
+    """Archiva lote a lote hasta que un lote no mueve nada; devuelve el total."""
+    total = 0
+    while True:
+        with get_conn() as conn:
+            moved = archive_batch(conn, min_age_days, batch_size)
+        if not moved:
+            return total
+        total += moved
+        time.sleep(pause)
+
+
+def archive_forever(get_conn, min_age_days, batch_size, pause, interval):
+    """Repite archive_all cada ``interval`` segundos (``archivar-prestamos --continuo``)."""
+    while True:
+        try:
+            moved = archive_all(get_conn, min_age_days, batch_size, pause)
+            if moved:
+                logger.info("Archivados %d préstamos devueltos", moved)
+        except Exception as e:
+            logger.warning("Error archivando préstamos: %s", e)
+        time.sleep(interval)
@@ -0,0 +1,171 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+from config import Config
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Versión no disponible: se consulta sin guardar nada en la caché
+_BYPASS = object()
+
+# Tabla afectada por una sentencia DML (INSERT/UPDATE/DELETE/MERGE/TRUNCATE)
+_DML_TABLE = re.compile(
+    r"^\s*(?:INSERT\s+INTO|UPDATE|DELETE\s+FROM|DELETE|MERGE\s+INTO|TRUNCATE\s+TABLE)\s+"
+    r"(?:\"?\w+\"?\.)?\"?([\w$#]+)\"?",
+    re.IGNORECASE,
+)
+
+
+def tables_written(sql):
+    """Devuelve el conjunto de tablas (en minúsculas) que modifica una sentencia DML."""
+    m = _DML_TABLE.match(sql or "")
+    return {m.group(1).lower()} if m else set()
+
+
+class QueryCache:
+    """Caché LRU de resultados de consultas, etiquetada por tabla.
+
+    Cada entrada se indexa por (sql, binds) y guarda las tablas que lee; una
+    escritura sobre cualquiera de esas tablas invalida la entrada. Las entradas
+    caducan tras ``ttl`` segundos, lo que acota la obsolescencia cuando otra
+    instancia del proceso escribe en la base de datos.
+
+    Si se asigna ``version_fn(tables)``, su resultado (p. ej. el último número
+    de un registro de cambios) se guarda con cada entrada y se compara antes
+    de servirla: así las escrituras hechas en otros procesos también invalidan.
+    Si ``version_fn`` falla, la consulta se hace sin pasar por la caché.
+    """
+
+    def __init__(self, max_entries=256, ttl=30, enabled=True):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # key -> (expira, tablas, valor, versión)
+        self._by_table = {}             # tabla -> set(keys)
+        self._generation = {}           # tabla -> contador de invalidaciones
+        self._inflight = {}             # key -> threading.Event
+        self.version_fn = None
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(sql, params=None):
+        normalized = " ".join(sql.split())
+        binds = tuple(sorted((params or {}).items()))
+        return (normalized, binds)
+
+    def get_or_compute(self, key, tables, compute):
+        """Devuelve el valor de ``key``; si falta, lo calcula una sola vez.
+
+        Mientras un hilo recalcula una entrada, los demás que pidan la misma
+        clave esperan su resultado en lugar de lanzar la misma consulta.
+        """
+        if not self.enabled:
+            return compute()
+
+        tables = tuple(t.lower() for t in tables)
+        # Se lee antes de calcular: si alguien escribe mientras tanto, la
+        # entrada queda con una versión anterior y no se volverá a servir
+        version = self._version(tables)
+        if version is _BYPASS:
+            return compute()
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry and entry[0] > time.monotonic() and entry[3] == version:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[2]
+                if entry:
+                    self._drop(key)
+                waiter = self._inflight.get(key)
+                if waiter is None:
+                    self.misses += 1
+                    event = self._inflight[key] = threading.Event()
+                    generations = {t: self._generation.get(t, 0) for t in tables}
+                    break
+            # Otro hilo está calculando la entrada: esperar y volver a mirar
+            if not waiter.wait(timeout=self.ttl or None):
+                logger.warning("Tiempo de espera agotado en caché para %s", key[0][:80])
+                return compute()
+
+        try:
+            value = compute()
+            with self._lock:
+                # Si hubo una escritura durante el cálculo, el valor puede estar obsoleto
+                stale = any(self._generation.get(t, 0) != g for t, g in generations.items())
+                if not stale:
+                    self._store(key, tables, value, version)
+            return value
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            event.set()
+
+    def invalidate(self, *tables):
+        """Elimina todas las entradas que leen alguna de las tablas indicadas."""
+        with self._lock:
+            for table in tables:
+                table = table.lower()
+                self._generation[table] = self._generation.get(table, 0) + 1
+                for key in list(self._by_table.get(table, ())):
+                    self._drop(key)
+
+    def clear(self):
+        with self._lock:
+            for table in self._by_table:
+                self._generation[table] = self._generation.get(table, 0) + 1
+            self._entries.clear()
+            self._by_table.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": (self.hits / total) if total else 0.0,
+            }
+
+    def _version(self, tables):
+        if self.version_fn is None:
+            return None
+        try:
+            return self.version_fn(tables)
+        except Exception as e:
+            # Sin versión fiable no se sirve ni se guarda nada para estas tablas
+            logger.debug("No se pudo leer la versión de %s: %s", tables, e)
+            return _BYPASS
+
+    # -- internos (llamar con self._lock tomado) --
+    def _store(self, key, tables, value, version=None):
+        if key in self._entries:
+            self._drop(key)
+        self._entries[key] = (time.monotonic() + self.ttl, tables, value, version)
+        for table in tables:
+            self._by_table.setdefault(table, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            oldest = next(iter(self._entries))
+            self._drop(oldest)
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if not entry:
+            return
+        for table in entry[1]:
+            keys = self._by_table.get(table)
+            if keys:
+                keys.discard(key)
+                if not keys:
+                    del self._by_table[table]
+
+
+query_cache = QueryCache(
+    max_entries=Config.QUERY_CACHE_MAX_ENTRIES,
+    ttl=Config.QUERY_CACHE_TTL,
+    enabled=Config.QUERY_CACHE_ENABLED,
+)
@@ -78,7 +78,8 @@ class Usuario:
 
 class Libro:
     def __init__(self, id=None, titulo=None, autor=None, año_publicacion=None, 
-                 genero=None, isbn=None, numero_copias=None, copias_disponibles=None, fecha_registro=None):
+                 genero=None, isbn=None, numero_copias=None, copias_disponibles=None, fecha_registro=None,
+                 fecha_modificacion=None):
         self.id = id
         self.titulo = titulo
         self.autor = autor
@@ -88,6 +89,7 @@ class Libro:
         self.numero_copias = numero_copias or 1
         self.copias_disponibles = copias_disponibles or self.numero_copias
         self.fecha_registro = fecha_registro
+        self.fecha_modificacion = fecha_modificacion
     
     @classmethod
     def get_all(cls):
@@ -1,5 +1,6 @@
 import cx_Oracle
 from config import Config
+from database.cache import query_cache, tables_written
 import logging
 
 logging.basicConfig(level=logging.INFO)
@@ -14,6 +15,14 @@ class OracleConnection:
             cls._instance._initialize_connection()
         return cls._instance
     
+    @classmethod
+    def reset(cls):
+        """Olvida la conexión heredada de un fork; el hijo abrirá la suya.
+
+        No se cierra: el socket es compartido con el proceso padre.
+        """
+        cls._instance = None
+
     def _initialize_connection(self):
         try:
             self.connection = cx_Oracle.connect(
@@ -35,6 +44,14 @@ class OracleConnection:
             self.connection.close()
             logger.info("Conexión a Oracle cerrada")
     
+    @staticmethod
+    def _invalidate_cache(query):
+        # Las escrituras de los modelos (save/delete/create/devolver) invalidan
+        # la caché de consultas de las tablas que modifican
+        written = tables_written(query)
+        if written:
+            query_cache.invalidate(*written)
+
     def execute_query(self, query, params=None, fetch=True):
         connection = self.get_connection()
         cursor = connection.cursor()
@@ -51,9 +68,11 @@ class OracleConnection:
                     return [dict(zip(columns, row)) for row in results]
                 else:
                     connection.commit()
+                    self._invalidate_cache(query)
                     return cursor.rowcount
             else:
                 connection.commit()
+                self._invalidate_cache(query)
                 return cursor.rowcount
                 
         except cx_Oracle.Error as error:
@@ -0,0 +1,52 @@
+-- Seguimiento de cambios del catálogo para la sincronización incremental
+-- (GET /api/v1/libros/cambios). Ejecutar una vez con el usuario dueño de LIBROS,
+-- p. ej.:  sqlplus SYSTEM/...@localhost:1521/XE @database/sql/01_libros_cambios.sql
+
+-- Secuencia monótona de cambios (ORDER: mantiene el orden también en RAC)
+CREATE SEQUENCE libros_cambios_seq START WITH 1 INCREMENT BY 1 CACHE 100 ORDER;
+
+ALTER TABLE libros ADD (fecha_modificacion TIMESTAMP DEFAULT SYSTIMESTAMP);
+
+-- Un registro por cada INSERT/UPDATE/DELETE sobre LIBROS; los 'D' son las
+-- marcas de borrado (la fila ya no existe en LIBROS)
+CREATE TABLE libros_cambios (
+    seq        NUMBER       NOT NULL,
+    libro_id   NUMBER       NOT NULL,
+    operacion  CHAR(1)      NOT NULL,
+    fecha      TIMESTAMP    DEFAULT SYSTIMESTAMP NOT NULL,   -- hora local del servidor, sin zona
+    CONSTRAINT libros_cambios_pk PRIMARY KEY (seq),
+    CONSTRAINT libros_cambios_op_ck CHECK (operacion IN ('I', 'U', 'D'))
+);
+
+CREATE INDEX libros_cambios_libro_idx ON libros_cambios (libro_id, seq);
+
+-- Punto de partida: todas las filas existentes cuentan como insertadas
+UPDATE libros SET fecha_modificacion = NVL(CAST(fecha_registro AS TIMESTAMP), SYSTIMESTAMP);
+INSERT INTO libros_cambios (seq, libro_id, operacion)
+    SELECT libros_cambios_seq.NEXTVAL, id, 'I' FROM libros;
+COMMIT;
+
+CREATE OR REPLACE TRIGGER libros_modificacion_trg
+BEFORE INSERT OR UPDATE ON libros
+FOR EACH ROW
+BEGIN
+    :NEW.fecha_modificacion := SYSTIMESTAMP;
+END;
+/
+
+CREATE OR REPLACE TRIGGER libros_cambios_trg
+AFTER INSERT OR UPDATE OR DELETE ON libros
+FOR EACH ROW
+BEGIN
+    IF DELETING THEN
+        INSERT INTO libros_cambios (seq, libro_id, operacion)
+        VALUES (libros_cambios_seq.NEXTVAL, :OLD.id, 'D');
+    ELSIF INSERTING THEN
+        INSERT INTO libros_cambios (seq, libro_id, operacion)
+        VALUES (libros_cambios_seq.NEXTVAL, :NEW.id, 'I');
+    ELSE
+        INSERT INTO libros_cambios (seq, libro_id, operacion)
+        VALUES (libros_cambios_seq.NEXTVAL, :NEW.id, 'U');
+    END IF;
+END;
+/
@@ -0,0 +1,23 @@
+-- Archivo de préstamos devueltos (ver database/archive.py). PRESTAMOS queda
+-- con los préstamos activos y los devueltos recientes; el resto pasa por
+-- lotes a PRESTAMOS_HISTORICO. Las vistas de historial leen PRESTAMOS_TODOS.
+--   sqlplus SYSTEM/...@localhost:1521/XE @database/sql/02_prestamos_historico.sql
+
+-- Misma estructura que PRESTAMOS (incluidas las columnas opcionales dias /
+-- penalizacion si existen). Si se añaden columnas a PRESTAMOS hay que
+-- añadirlas aquí también: el archivado copia con SELECT *.
+CREATE TABLE prestamos_historico AS SELECT * FROM prestamos WHERE 1 = 0;
+
+ALTER TABLE prestamos_historico ADD CONSTRAINT prestamos_historico_pk PRIMARY KEY (id);
+CREATE INDEX prestamos_historico_usuario_idx ON prestamos_historico (usuario_id);
+
+-- Conteos de préstamos activos (dashboard, prestamos_listar) sin recorrer la tabla
+CREATE INDEX prestamos_estado_usuario_idx ON prestamos (estado, usuario_id);
+CREATE INDEX prestamos_usuario_idx ON prestamos (usuario_id);
+-- Candidatos a archivar
+CREATE INDEX prestamos_estado_devolucion_idx ON prestamos (estado, fecha_devolucion);
+
+CREATE OR REPLACE VIEW prestamos_todos AS
+    SELECT * FROM prestamos
+    UNION ALL
+    SELECT * FROM prestamos_historico;
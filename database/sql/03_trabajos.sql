@@ -0,0 +1,29 @@
+-- Trabajos en segundo plano (informes y exportaciones, ver jobs.py).
+--   sqlplus SYSTEM/...@localhost:1521/XE @database/sql/03_trabajos.sql
+
+CREATE TABLE trabajos (
+    id              NUMBER GENERATED BY DEFAULT AS IDENTITY,
+    tipo            VARCHAR2(50)    NOT NULL,
+    clave           VARCHAR2(64)    NOT NULL,   -- sha256(tipo + parámetros)
+    parametros      VARCHAR2(4000),             -- JSON
+    version_datos   VARCHAR2(100),              -- versión de los datos al encolar
+    estado          VARCHAR2(20)    DEFAULT 'PENDIENTE' NOT NULL,
+    progreso        NUMBER(5, 2)    DEFAULT 0 NOT NULL,
+    archivo         VARCHAR2(500),
+    error           VARCHAR2(4000),
+    usuario_id      NUMBER,
+    fecha_creacion  TIMESTAMP       DEFAULT SYSTIMESTAMP NOT NULL,
+    fecha_inicio    TIMESTAMP,
+    ultima_actividad TIMESTAMP,                 -- latido del ejecutor mientras está EN_PROCESO
+    fecha_fin       TIMESTAMP,
+    CONSTRAINT trabajos_pk PRIMARY KEY (id),
+    CONSTRAINT trabajos_estado_ck CHECK (estado IN ('PENDIENTE', 'EN_PROCESO', 'COMPLETADO', 'ERROR'))
+);
+
+-- Como mucho un trabajo pendiente o en proceso por clave: las peticiones
+-- idénticas simultáneas se unen al mismo trabajo
+CREATE UNIQUE INDEX trabajos_activos_uk ON trabajos (
+    CASE WHEN estado IN ('PENDIENTE', 'EN_PROCESO') THEN clave END
+);
+
+CREATE INDEX trabajos_clave_idx ON trabajos (clave, estado);
@@ -0,0 +1,59 @@
+# gunicorn.conf.py
+# Servidor de producción:  gunicorn -c gunicorn.conf.py myapp:app
+#
+# Recarga sin cortar peticiones:  kill -HUP <pid del master>
+#   (arranca workers nuevos con el código actual y deja terminar a los
+#   antiguos hasta graceful_timeout segundos)
+import multiprocessing
+import os
+import sys
+
+bind = os.getenv("WEB_BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+
+# gthread: WEB_THREADS hilos por worker. gevent (pip install gevent): hasta
+# WEB_WORKER_CONNECTIONS peticiones por worker, que esperan turno en el pool
+# de conexiones si hay más que conexiones (ver myapp.db_pool_size)
+worker_class = os.getenv("WEB_WORKER_CLASS", "gthread")
+threads = int(os.getenv("WEB_THREADS", "4"))
+worker_connections = int(os.getenv("WEB_WORKER_CONNECTIONS", "100"))
+
+# Reciclar cada worker tras N peticiones (con jitter para no reiniciarlos a la vez)
+max_requests = int(os.getenv("WEB_MAX_REQUESTS", "1000"))
+max_requests_jitter = int(os.getenv("WEB_MAX_REQUESTS_JITTER", "100"))
+
+timeout = int(os.getenv("WEB_TIMEOUT", "60"))
+graceful_timeout = int(os.getenv("WEB_GRACEFUL_TIMEOUT", "30"))
+keepalive = 5
+
+# Sin preload: con HUP se recarga el código y nada de la app (conexiones,
+# hilos) se crea en el master antes del fork
+preload_app = False
+
+accesslog = os.getenv("WEB_ACCESS_LOG", "-") or None      # vacío: sin log de accesos
+errorlog = "-"
+
+# Los trabajos en segundo plano (jobs.py) no se ejecutan en los workers web:
+# van en un servicio aparte, "flask --app myapp trabajos" (ver README)
+os.environ["JOBS_EMBEDDED"] = "0"
+
+
+def on_starting(server):
+    # No importar myapp aquí: quedaría cargada en el master y HUP no recargaría el código.
+    # Cada worker abre hasta myapp.db_pool_size() sesiones Oracle.
+    server.log.info("Workers: %s x %s (%s)", workers,
+                    threads if worker_class == "gthread" else worker_connections, worker_class)
+
+
+def post_fork(server, worker):
+    # Por si se activa preload_app: la conexión del singleton no se comparte con el hijo.
+    # Si el módulo no está cargado no hay singleton (y puede faltar cx_Oracle)
+    module = sys.modules.get("database.oracle_connection")
+    if module is not None:
+        module.OracleConnection.reset()
+
+
+def post_worker_init(worker):
+    # Pool de conexiones e hilos de fondo propios de este worker
+    from myapp import init_worker
+    init_worker()
@@ -0,0 +1,369 @@
+# jobs.py
+"""Ejecución en segundo plano de informes y exportaciones.
+
+Los trabajos se guardan en la tabla TRABAJOS (database/sql/03_trabajos.sql).
+Los workers web solo los encolan; un único proceso ejecutor
+(``flask --app myapp trabajos``, instalado como servicio aparte) los reclama
+y ejecuta con JOBS_WORKERS hilos, y el resultado se escribe como fichero en
+REPORTS_DIR. El límite de trabajos en ejecución se
+comprueba en la base de datos al reclamar, así que es global aunque haya
+más de un ejecutor.
+
+Dos peticiones con el mismo tipo y parámetros comparten trabajo, y un fichero
+terminado se reutiliza mientras la versión de los datos de su informe no
+cambie. El ejecutor renueva ``ultima_actividad`` de sus trabajos cada
+JOBS_HEARTBEAT_S segundos; los que llevan más de JOBS_STALE_S sin latido (su
+proceso murió) vuelven a PENDIENTE.
+"""
+import hashlib
+import json
+import os
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import oracledb
+import logging
+
+logger = logging.getLogger(__name__)
+
+# tipo -> Report
+_reports = {}
+_settings = {}
+_get_conn = None
+
+
+class QueueFull(Exception):
+    pass
+
+
+class Report:
+    """Definición de un informe.
+
+    ``version_sql`` devuelve una sola fila/columna que cambia cuando cambian
+    los datos del informe; ``build(conn, params, out, progress)`` escribe el
+    resultado en el fichero de texto ``out`` y llama a ``progress(pct)``.
+
+    ``roles`` limita quién puede pedirlo y verlo (None: cualquier usuario con
+    sesión). Con ``per_user`` el resultado contiene datos de quien lo pidió:
+    no se comparte entre usuarios y solo su dueño lo ve o descarga.
+    """
+
+    def __init__(self, tipo, build, version_sql, extension="csv", roles=None, per_user=False):
+        self.tipo = tipo
+        self.build = build
+        self.version_sql = version_sql
+        self.extension = extension
+        self.roles = roles
+        self.per_user = per_user
+
+
+def register(tipo, build, version_sql, extension="csv", roles=None, per_user=False):
+    _reports[tipo] = Report(tipo, build, version_sql, extension, roles, per_user)
+
+
+def allowed(tipo, rol):
+    """True si un usuario con ``rol`` puede pedir informes ``tipo``."""
+    report = _reports.get(tipo)
+    return report is not None and (not report.roles or rol in report.roles)
+
+
+def can_access(trabajo, usuario_id, rol):
+    """True si el usuario puede ver el estado y el fichero de ``trabajo``."""
+    if not allowed(trabajo["tipo"], rol):
+        return False
+    return not _reports[trabajo["tipo"]].per_user or trabajo["usuario_id"] == usuario_id
+
+
+def init_app(app, get_conn):
+    global _get_conn
+    _get_conn = get_conn
+    _settings.update(
+        workers=app.config["JOBS_WORKERS"],
+        max_pending=app.config["JOBS_MAX_PENDING"],
+        stale_s=app.config["JOBS_STALE_S"],
+        heartbeat_s=app.config["JOBS_HEARTBEAT_S"],
+        poll_s=app.config["JOBS_POLL_S"],
+        # Relativo a la aplicación, no al directorio de trabajo: web y ejecutor
+        # pueden arrancar desde sitios distintos
+        directory=os.path.join(app.root_path, app.config["REPORTS_DIR"]),
+    )
+    os.makedirs(_settings["directory"], exist_ok=True)
+
+
+def _key(tipo, params):
+    raw = json.dumps([tipo, params], sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _row(cur):
+    row = cur.fetchone()
+    if not row:
+        return None
+    cols = [d[0].lower() for d in cur.description]
+    return dict(zip(cols, row))
+
+
+_SELECT = """
+    SELECT id, tipo, estado, progreso, archivo, error, version_datos, usuario_id,
+           fecha_creacion, fecha_inicio, fecha_fin
+    FROM trabajos
+"""
+
+# ultima_actividad es TIMESTAMP sin zona (hora del servidor); compararla con
+# SYSTIMESTAMP la convertiría con la zona horaria de la sesión
+_STALE = "ultima_actividad < CAST(SYSTIMESTAMP AS TIMESTAMP) - NUMTODSINTERVAL(:stale, 'SECOND')"
+
+
+def file_path(trabajo):
+    """Ruta del fichero de un trabajo; en la tabla solo se guarda el nombre."""
+    if not trabajo or not trabajo.get("archivo"):
+        return None
+    return os.path.join(_settings["directory"], os.path.basename(trabajo["archivo"]))
+
+
+def get(trabajo_id):
+    with _get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(_SELECT + " WHERE id = :id", {"id": trabajo_id})
+            return _row(cur)
+
+
+def enqueue(tipo, params, usuario_id=None):
+    """Devuelve el trabajo (dict) que produce ``tipo`` con ``params``.
+
+    Puede ser un trabajo ya terminado con datos vigentes, uno pendiente o en
+    curso con la misma clave o uno nuevo recién encolado.
+    """
+    report = _reports[tipo]
+    # Un informe por usuario nunca reutiliza el trabajo de otro
+    clave = _key(tipo, dict(params, _usuario=usuario_id) if report.per_user else params)
+    with _get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(report.version_sql)
+            version = str(cur.fetchone()[0])
+
+            cur.execute(_SELECT + """
+                WHERE clave = :clave AND estado = 'COMPLETADO' AND version_datos = :version
+                ORDER BY id DESC FETCH FIRST 1 ROWS ONLY
+            """, {"clave": clave, "version": version})
+            done = _row(cur)
+            if done and done["archivo"] and os.path.exists(file_path(done)):
+                return done
+
+            # Un trabajo de esta clave cuyo ejecutor murió no debe acaparar la clave
+            cur.execute(f"""
+                UPDATE trabajos SET estado = 'PENDIENTE', fecha_inicio = NULL
+                WHERE clave = :clave AND estado = 'EN_PROCESO' AND {_STALE}
+            """, {"clave": clave, "stale": _settings["stale_s"]})
+            conn.commit()
+
+            active = _active(cur, clave)
+            if active:
+                return active
+
+            cur.execute("SELECT COUNT(*) FROM trabajos WHERE estado = 'PENDIENTE'")
+            if cur.fetchone()[0] >= _settings["max_pending"]:
+                raise QueueFull(tipo)
+
+            new_id = cur.var(oracledb.NUMBER)
+            try:
+                cur.execute("""
+                    INSERT INTO trabajos (tipo, clave, parametros, version_datos, usuario_id)
+                    VALUES (:tipo, :clave, :parametros, :version, :usuario_id)
+                    RETURNING id INTO :new_id
+                """, {"tipo": tipo, "clave": clave, "parametros": json.dumps(params),
+                      "version": version, "usuario_id": usuario_id, "new_id": new_id})
+                conn.commit()
+            except oracledb.IntegrityError:
+                # Otra petición idéntica acaba de encolarlo (índice trabajos_activos_uk)
+                conn.rollback()
+                active = _active(cur, clave)
+                if active:
+                    return active
+                raise
+            trabajo_id = int(new_id.getvalue()[0])
+
+    return get(trabajo_id)
+
+
+def _active(cur, clave):
+    cur.execute(_SELECT + " WHERE clave = :clave AND estado IN ('PENDIENTE', 'EN_PROCESO')",
+                {"clave": clave})
+    return _row(cur)
+
+
+# ----------------- Ejecutor -----------------
+def _claim(conn):
+    """Reclama el trabajo pendiente más antiguo si hay hueco; devuelve su id o None.
+
+    El bloqueo de la tabla (solo hasta el commit) serializa los reclamos de
+    todos los ejecutores, así que nunca hay más de JOBS_WORKERS en proceso.
+    """
+    with conn.cursor() as cur:
+        cur.execute("LOCK TABLE trabajos IN EXCLUSIVE MODE")
+        cur.execute("SELECT COUNT(*) FROM trabajos WHERE estado = 'EN_PROCESO'")
+        if cur.fetchone()[0] >= _settings["workers"]:
+            conn.rollback()
+            return None
+        cur.execute("""
+            SELECT id FROM trabajos WHERE estado = 'PENDIENTE'
+            ORDER BY id FETCH FIRST 1 ROWS ONLY
+        """)
+        row = cur.fetchone()
+        if not row:
+            conn.rollback()
+            return None
+        cur.execute("""
+            UPDATE trabajos
+            SET estado = 'EN_PROCESO', fecha_inicio = SYSTIMESTAMP, ultima_actividad = SYSTIMESTAMP
+            WHERE id = :id
+        """, {"id": row[0]})
+    conn.commit()
+    return row[0]
+
+
+def _heartbeat(conn, running):
+    with conn.cursor() as cur:
+        if running:
+            cur.executemany("UPDATE trabajos SET ultima_actividad = SYSTIMESTAMP WHERE id = :id",
+                            [{"id": i} for i in running])
+        cur.execute(f"""
+            UPDATE trabajos SET estado = 'PENDIENTE', fecha_inicio = NULL
+            WHERE estado = 'EN_PROCESO' AND {_STALE}
+        """, {"stale": _settings["stale_s"]})
+        if cur.rowcount:
+            logger.warning("Reencolados %d trabajos sin latido", cur.rowcount)
+    conn.commit()
+
+
+def _release(running):
+    """Devuelve a PENDIENTE los trabajos que este ejecutor deja sin terminar."""
+    if not running:
+        return
+    with _get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.executemany("""
+                UPDATE trabajos SET estado = 'PENDIENTE', fecha_inicio = NULL, progreso = 0
+                WHERE id = :id AND estado = 'EN_PROCESO'
+            """, [{"id": i} for i in running])
+        conn.commit()
+    logger.info("Trabajos devueltos a la cola al parar: %s", sorted(running))
+
+
+def run_forever(standalone=True):
+    """Bucle del ejecutor.
+
+    Como proceso propio (``standalone``) termina con SIGTERM/SIGINT; dentro del
+    servidor de desarrollo corre en un hilo hasta que el proceso acaba.
+    """
+    stop = threading.Event()
+    if standalone:
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(sig, lambda *_: stop.set())
+
+    running = set()
+    lock = threading.Lock()
+    executor = ThreadPoolExecutor(max_workers=_settings["workers"], thread_name_prefix="trabajos")
+
+    def finished(trabajo_id):
+        with lock:
+            running.discard(trabajo_id)
+
+    last_beat = 0.0
+    logger.info("Ejecutor de trabajos en marcha (pid %s, %s hilos)", os.getpid(), _settings["workers"])
+    while not stop.is_set():
+        try:
+            with _get_conn() as conn:
+                if time.monotonic() - last_beat >= _settings["heartbeat_s"]:
+                    with lock:
+                        current = list(running)
+                    _heartbeat(conn, current)
+                    last_beat = time.monotonic()
+                while not stop.is_set():
+                    with lock:
+                        if len(running) >= _settings["workers"]:
+                            break
+                    trabajo_id = _claim(conn)
+                    if trabajo_id is None:
+                        break
+                    with lock:
+                        running.add(trabajo_id)
+                    executor.submit(_run, trabajo_id).add_done_callback(
+                        lambda _f, t=trabajo_id: finished(t))
+        except Exception as e:
+            # Incluye pool agotado: el bucle no debe morir, se reintenta en poll_s
+            logger.warning("Error en el ejecutor de trabajos: %s", e)
+        stop.wait(_settings["poll_s"])
+
+    # Sin esperar a los hilos: lo que quede a medias vuelve a la cola
+    with lock:
+        pending = set(running)
+    _release(pending)
+    os._exit(0)
+
+
+def _run(trabajo_id):
+    with _get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT tipo, clave, parametros FROM trabajos WHERE id = :id", {"id": trabajo_id})
+            tipo, clave, parametros = cur.fetchone()
+
+        report = _reports[tipo]
+        name = f"{tipo}_{trabajo_id}.{report.extension}"
+        path = os.path.join(_settings["directory"], name)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        last = [0.0]
+
+        def progress(pct):
+            # Como mucho una actualización por segundo
+            now = time.monotonic()
+            if now - last[0] < 1:
+                return
+            last[0] = now
+            with conn.cursor() as pc:
+                pc.execute("""
+                    UPDATE trabajos SET progreso = :p, ultima_actividad = SYSTIMESTAMP
+                    WHERE id = :id
+                """, {"p": round(min(pct, 99.99), 2), "id": trabajo_id})
+            conn.commit()
+
+        try:
+            with open(tmp, "w", encoding="utf-8", newline="") as out:
+                report.build(conn, json.loads(parametros or "{}"), out, progress)
+            os.replace(tmp, path)
+        except Exception as e:
+            logger.exception("Trabajo %s (%s) fallido", trabajo_id, tipo)
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            conn.rollback()
+            with conn.cursor() as cur:
+                cur.execute("""
+                    UPDATE trabajos SET estado = 'ERROR', error = :error, fecha_fin = SYSTIMESTAMP
+                    WHERE id = :id
+                """, {"error": str(e)[:4000], "id": trabajo_id})
+            conn.commit()
+            return
+
+        with conn.cursor() as cur:
+            cur.execute("""
+                UPDATE trabajos SET estado = 'COMPLETADO', progreso = 100, archivo = :archivo,
+                                    fecha_fin = SYSTIMESTAMP
+                WHERE id = :id
+            """, {"archivo": name, "id": trabajo_id})
+            # Los ficheros anteriores del mismo informe ya no sirven
+            cur.execute("""
+                SELECT id, archivo FROM trabajos
+                WHERE clave = :clave AND estado = 'COMPLETADO' AND id < :id AND archivo IS NOT NULL
+            """, {"clave": clave, "id": trabajo_id})
+            old = cur.fetchall()
+            for _, archivo in old:
+                try:
+                    os.remove(file_path({"archivo": archivo}))
+                except OSError:
+                    pass
+            if old:
+                cur.executemany("UPDATE trabajos SET archivo = NULL WHERE id = :id",
+                                [{"id": r[0]} for r in old])
+        conn.commit()
+        logger.info("Trabajo %s (%s) completado: %s", trabajo_id, tipo, path)
@@ -0,0 +1,92 @@
+# loadtest.py
+"""Prueba de carga local para comparar servidores.
+
+Inicia sesión una vez, lanza peticiones concurrentes contra unas rutas y
+muestra peticiones por segundo y latencias. Ejemplo:
+
+    python loadtest.py --base http://127.0.0.1:5050 --email admin@biblioteca.com \\
+        --password admin123 --concurrency 16 --duration 30 /libros /dashboard
+"""
+import argparse
+import http.cookiejar
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+
+def make_opener(base, email, password):
+    jar = http.cookiejar.CookieJar()
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(jar))
+    if email:
+        data = urllib.parse.urlencode({"email": email, "password": password}).encode()
+        opener.open(base + "/login", data=data, timeout=30).read()
+    return opener
+
+
+def worker(opener, urls, deadline, latencies, errors, lock):
+    i = 0
+    while time.monotonic() < deadline:
+        url = urls[i % len(urls)]
+        i += 1
+        t0 = time.perf_counter()
+        try:
+            with opener.open(url, timeout=60) as resp:
+                while resp.read(65536):
+                    pass
+            ok = True
+        except (urllib.error.URLError, OSError):
+            ok = False
+        elapsed = time.perf_counter() - t0
+        with lock:
+            if ok:
+                latencies.append(elapsed)
+            else:
+                errors.append(elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("paths", nargs="*", default=["/libros"])
+    parser.add_argument("--base", default="http://127.0.0.1:8000")
+    parser.add_argument("--email")
+    parser.add_argument("--password", default="")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--output", help="añade el resultado a este fichero")
+    args = parser.parse_args()
+
+    base = args.base.rstrip("/")
+    urls = [base + p for p in args.paths]
+    latencies, errors, lock = [], [], threading.Lock()
+    deadline = time.monotonic() + args.duration
+    threads = [
+        threading.Thread(target=worker, daemon=True,
+                         args=(make_opener(base, args.email, args.password), urls,
+                               deadline, latencies, errors, lock))
+        for _ in range(args.concurrency)
+    ]
+    started = time.monotonic()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.monotonic() - started
+
+    lines = [f"{base} {' '.join(args.paths)} concurrency={args.concurrency} duration={wall:.1f}s",
+             f"  ok={len(latencies)} errores={len(errors)} req/s={len(latencies) / wall:.1f}"]
+    if latencies:
+        q = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+        lines.append(f"  latencia ms: p50={q[49] * 1000:.1f} p95={q[94] * 1000:.1f} "
+                     f"p99={q[98] * 1000:.1f} max={max(latencies) * 1000:.1f}")
+    report = "\n".join(lines)
+    print(report)
+    if args.output:
+        with open(args.output, "a", encoding="utf-8") as fh:
+            fh.write(report + "\n")
+
+
+if __name__ == "__main__":
+    main()
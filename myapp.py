@@ -1,65 +1,285 @@
 # myapp.py
-from flask import Flask, render_template, request, redirect, url_for, session, flash, abort
+from flask import (Flask, render_template, request, redirect, url_for, session, flash, abort,
+                   get_flashed_messages, stream_with_context, send_file, g, has_request_context)
 from werkzeug.security import check_password_hash
+import click
 from datetime import timedelta
 from functools import wraps
-import os, oracledb
+import os, oracledb, threading, time
+import base64, gzip, json
 from config import Config
+from database.cache import query_cache, tables_written
+from database import archive
+import profiling
+import jobs
+
+try:
+    import orjson                               # opcional: serializador JSON más rápido
+except ImportError:
+    orjson = None
 
 # ----------------- App -----------------
 app = Flask(__name__, template_folder="templates", static_folder="static")
 app.config.from_object(Config)                 # SECRET_KEY, ORA_USER, etc.
 app.permanent_session_lifetime = timedelta(minutes=30)
+profiling.init_app(app)                        # no-op salvo PROFILE_SAMPLE_RATE / PROFILE_SLOW_MS
 
 # ----------------- DB helpers -----------------
+# Un pool de conexiones por proceso: se crea en el primer uso dentro del
+# proceso (o en init_worker), nunca antes de un fork
+_pool = {"pid": None, "pool": None}
+_pool_lock = threading.Lock()
+
+class PoolTimeout(Exception):
+    """No quedó ninguna conexión libre en DB_POOL_WAIT_TIMEOUT_MS (se responde 503)."""
+
+def db_pool_size():
+    """Conexiones por proceso: peticiones simultáneas (+ trabajos si el ejecutor va dentro).
+
+    Con gevent cada worker atiende hasta WEB_WORKER_CONNECTIONS peticiones; el
+    pool se limita a DB_POOL_GEVENT_MAX y el resto espera turno (como mucho
+    DB_POOL_WAIT_TIMEOUT_MS).
+    """
+    if app.config["DB_POOL_MAX"]:
+        return app.config["DB_POOL_MAX"]
+    if app.config["WEB_WORKER_CLASS"] == "gevent":
+        web = min(app.config["WEB_WORKER_CONNECTIONS"], app.config["DB_POOL_GEVENT_MAX"])
+    else:
+        web = app.config["WEB_THREADS"]
+    return web + (app.config["JOBS_WORKERS"] + 1 if app.config["JOBS_EMBEDDED"] else 0)
+
+def _get_pool():
+    if _pool["pid"] == os.getpid():
+        return _pool["pool"]
+    with _pool_lock:
+        if _pool["pid"] != os.getpid():
+            size = db_pool_size()
+            _pool["pool"] = oracledb.create_pool(
+                user=os.getenv("ORA_USER", "SYSTEM"),
+                password=os.getenv("ORA_PASS", "12345678"),
+                dsn=os.getenv("ORA_DSN", "localhost:1521/XE"),
+                min=min(app.config["DB_POOL_MIN"], size),
+                max=size,
+                increment=1,
+                getmode=oracledb.POOL_GETMODE_TIMEDWAIT,
+                wait_timeout=app.config["DB_POOL_WAIT_TIMEOUT_MS"],
+            )
+            _pool["pid"] = os.getpid()
+            app.logger.info("Pool Oracle creado en pid %s (max=%s)", os.getpid(), size)
+    return _pool["pool"]
+
 def get_conn():
-    return oracledb.connect(
-        user=os.getenv("ORA_USER", "SYSTEM"),
-        password=os.getenv("ORA_PASS", "12345678"),
-        dsn=os.getenv("ORA_DSN", "localhost:1521/XE")
-    )
+    # Al cerrar la conexión (``with get_conn() as conn``) vuelve al pool
+    try:
+        return _get_pool().acquire()
+    except oracledb.Error as e:
+        if getattr(e.args[0], "full_code", None) == "DPY-4005":
+            raise PoolTimeout(str(e)) from e
+        raise
 
-def query_one(sql, params=None):
+@app.errorhandler(PoolTimeout)
+def _pool_timeout(e):
+    # Mejor un 503 rápido que peticiones acumulándose hasta el timeout de gunicorn
+    app.logger.warning("Pool Oracle agotado en pid %s: %s", os.getpid(), e)
+    headers = {"Retry-After": str(app.config["DB_POOL_RETRY_AFTER_S"])}
+    if request.path.startswith("/api/"):
+        return api_response({"error": "Servidor ocupado, inténtalo de nuevo"}, status=503), headers
+    return "Servidor ocupado, inténtalo de nuevo en unos segundos", 503, headers
+
+def _fetch_one(sql, params=None):
     with get_conn() as conn:
         with conn.cursor() as cur:
-            cur.execute(sql, params or {})
-            row = cur.fetchone()
+            profiling.traced_execute(cur, sql, params)
+            row = profiling.traced_fetch(cur, "fetchone")
             if not row:
                 return None
             cols = [d[0].lower() for d in cur.description]
             return dict(zip(cols, row))
 
-def query_all(sql, params=None):
+def _fetch_all(sql, params=None):
     with get_conn() as conn:
         with conn.cursor() as cur:
-            cur.execute(sql, params or {})
-            rows = cur.fetchall()
+            profiling.traced_execute(cur, sql, params)
+            rows = profiling.traced_fetch(cur, "fetchall")
             cols = [d[0].lower() for d in cur.description]
             return [dict(zip(cols, r)) for r in rows]
 
+# Tablas con registro de cambios compartido por todos los procesos: una
+# entrada cacheada solo se sirve si su último cambio no se ha movido, así que
+# una edición hecha en otro worker se ve en la siguiente petición
+CACHE_VERSION_SQL = {
+    "libros": "SELECT NVL(MAX(seq), 0) AS v FROM libros_cambios",
+}
+# tabla -> instante hasta el que no se vuelve a probar (falta 01_libros_cambios.sql)
+_cache_version_missing = {}
+
+def _cache_versions(tables):
+    """Versión de las tablas con registro de cambios; se lee una vez por petición.
+
+    Si falla (p. ej. no existe libros_cambios) query_cache consulta sin caché.
+    """
+    memo = g.setdefault("cache_versions", {}) if has_request_context() else {}
+    versions = []
+    for t in tables:
+        if t not in CACHE_VERSION_SQL:
+            continue
+        if t not in memo:
+            if time.monotonic() < _cache_version_missing.get(t, 0):
+                raise LookupError(f"sin registro de cambios para {t}")
+            try:
+                memo[t] = _fetch_one(CACHE_VERSION_SQL[t])["v"]
+            except oracledb.DatabaseError as e:
+                if e.args[0].code == 942:
+                    _cache_version_missing[t] = time.monotonic() + 60
+                raise
+        versions.append(memo[t])
+    return tuple(versions)
+
+query_cache.version_fn = _cache_versions
+
+def query_one(sql, params=None, tables=None):
+    """Devuelve la primera fila como dict (o None).
+
+    Si se indica ``tables`` (las tablas que lee la consulta) el resultado se
+    guarda en la caché de consultas y se invalida al escribir en ellas.
+    """
+    if not tables:
+        return _fetch_one(sql, params)
+    row = query_cache.get_or_compute(query_cache.make_key(sql, params), tables,
+                                     lambda: _fetch_one(sql, params))
+    return dict(row) if row else row
+
+def query_all(sql, params=None, tables=None):
+    """Devuelve todas las filas como lista de dicts; ``tables`` como en query_one."""
+    if not tables:
+        return _fetch_all(sql, params)
+    rows = query_cache.get_or_compute(query_cache.make_key(sql, params), tables,
+                                      lambda: _fetch_all(sql, params))
+    return [dict(r) for r in rows]
+
 def execute(sql, params=None):
     with get_conn() as conn:
         with conn.cursor() as cur:
-            cur.execute(sql, params or {})
+            profiling.traced_execute(cur, sql, params)
         conn.commit()
+    written = tables_written(sql)
+    if written:
+        query_cache.invalidate(*written)
+        if has_request_context():
+            g.pop("cache_versions", None)
+
+def stream_query(sql, params=None, tables=None, max_rows=None):
+    """Ejecuta la consulta y devuelve un iterador de filas (dicts) leídas por lotes.
+
+    La sentencia se ejecuta en el momento (los errores se lanzan aquí, no al
+    iterar); la conexión se cierra al agotar o cerrar el iterador. Mientras
+    el iterador siga abierto no se debe pedir otra conexión: toda consulta
+    de la vista va antes de llamar a stream_query.
+
+    Con ``tables`` y ``max_rows`` (cota del número de filas) por debajo de
+    STREAM_CACHE_MAX_ROWS, el resultado es pequeño y se lee entero con
+    query_all, que lo cachea; si no, se lee del cursor sin guardarlo.
+    """
+    if (tables and query_cache.enabled and max_rows is not None
+            and max_rows <= app.config["STREAM_CACHE_MAX_ROWS"]):
+        return iter(query_all(sql, params, tables=tables))
+
+    conn = get_conn()
+    try:
+        cur = conn.cursor()
+        cur.arraysize = app.config["STREAM_FETCH_SIZE"]
+        cur.prefetchrows = app.config["STREAM_FETCH_SIZE"]
+        profiling.traced_execute(cur, sql, params)
+        cols = [d[0].lower() for d in cur.description]
+    except Exception:
+        conn.close()
+        raise
 
-def safe_count(sql, params=None):
+    def rows():
+        try:
+            while True:
+                batch = profiling.traced_fetch(cur, "fetchmany")
+                if not batch:
+                    break
+                for r in batch:
+                    yield dict(zip(cols, r))
+        finally:
+            cur.close()
+            conn.close()
+    return rows()
+
+def safe_count(sql, params=None, tables=None):
     """Devuelve 0 si la tabla no existe o hay error.
 
     Acepta bind params opcionales y las pasa a query_one para consultas seguras.
     """
     try:
-        r = query_one(sql, params or {})
+        r = query_one(sql, params or {}, tables=tables)
         return (r or {}).get("c", 0) or 0
+    except PoolTimeout:
+        raise
     except Exception:
         app.logger.debug("safe_count fallo para sql=%s params=%s", sql, params)
         return 0
 
+def render_stream(template_name, **context):
+    """Como render_template, pero envía la página a medida que Jinja la genera.
+
+    Pensado para listados grandes alimentados por ``stream_query``: la cabecera
+    y las primeras filas salen antes de leer el resto del cursor.
+    """
+    # Los mensajes flash se sacan de la sesión ahora: una vez enviadas las
+    # cabeceras ya no se puede guardar la cookie de sesión
+    get_flashed_messages(with_categories=True)
+    app.update_template_context(context)
+    stream = app.jinja_env.get_template(template_name).stream(context)
+    stream.enable_buffering(app.config["STREAM_BUFFER_SIZE"])
+    return app.response_class(stream_with_context(stream), mimetype="text/html")
+
+_worker = {"pid": None}
+_worker_lock = threading.Lock()
+
+def init_worker():
+    """Prepara los recursos del proceso: pool de conexiones e hilos de fondo.
+
+    Idempotente; gunicorn la llama al arrancar cada worker (gunicorn.conf.py)
+    y con el servidor de desarrollo se ejecuta en la primera petición.
+    """
+    with _worker_lock:
+        if _worker["pid"] == os.getpid():
+            return
+        _get_pool()
+        if app.config["JOBS_EMBEDDED"]:
+            threading.Thread(target=jobs.run_forever, args=(False,),
+                             name="trabajos-ejecutor", daemon=True).start()
+        _worker["pid"] = os.getpid()
+
+@app.before_request
+def _init_worker():
+    if _worker["pid"] != os.getpid():
+        init_worker()
+
+
+@app.cli.command("archivar-prestamos")
+@click.option("--continuo", is_flag=True,
+              help="No terminar: repetir cada ARCHIVE_INTERVAL_S segundos.")
+def archivar_prestamos_command(continuo):
+    """Archiva los préstamos devueltos antiguos (desde cron o como servicio único)."""
+    args = (get_conn, app.config["ARCHIVE_MIN_AGE_DAYS"],
+            app.config["ARCHIVE_BATCH_SIZE"], app.config["ARCHIVE_BATCH_PAUSE_S"])
+    if not continuo:
+        print(f"Préstamos archivados: {archive.archive_all(*args)}")
+        return
+    archive.archive_forever(*args, interval=app.config["ARCHIVE_INTERVAL_S"])
+
 # ----------------- Auth helpers -----------------
 def login_required(fn):
     @wraps(fn)
     def wrapper(*args, **kwargs):
         if "user_id" not in session:
+            # Los clientes de la API (kiosco, móvil) esperan JSON, no la página de login
+            if request.path.startswith("/api/"):
+                raise ApiError("Sesión requerida", status=401)
             return redirect(url_for("login"))
         return fn(*args, **kwargs)
     return wrapper
@@ -113,37 +333,42 @@ def logout():
     return redirect(url_for("login"))
 
 # ----------------- Dashboard -----------------
-@app.get("/dashboard", endpoint="dashboard")
-@login_required
-def dashboard():
-    tot_usuarios   = safe_count("SELECT COUNT(*) c FROM usuarios")
-    tot_libros     = safe_count("SELECT COUNT(*) c FROM libros")
+def _session_user_id():
+    try:
+        return int(session.get("user_id"))
+    except Exception:
+        return session.get("user_id")
+
+def _dashboard_counts():
+    tot_usuarios   = safe_count("SELECT COUNT(*) c FROM usuarios", tables=("usuarios",))
+    tot_libros     = safe_count("SELECT COUNT(*) c FROM libros", tables=("libros",))
     if session.get("user_rol") in ("BIBLIOTECARIO", "ADMIN"):
         tot_prestamos = safe_count("SELECT COUNT(*) c FROM prestamos WHERE estado='ACTIVO'")
     else:
-        try:
-            uid = int(session.get("user_id"))
-        except Exception:
-            uid = session.get("user_id")
+        uid = _session_user_id()
         app.logger.debug("dashboard: counting prestamos for user_id=%s", uid)
         tot_prestamos = safe_count("SELECT COUNT(*) c FROM prestamos WHERE estado='ACTIVO' AND usuario_id=:user_id", {"user_id": uid})
+    return {"tot_usuarios": tot_usuarios, "tot_libros": tot_libros, "tot_prestamos": tot_prestamos}
+
+@app.get("/dashboard", endpoint="dashboard")
+@login_required
+def dashboard():
     return render_template("dashboard.html",
-                           tot_usuarios=tot_usuarios,
-                           tot_libros=tot_libros,
-                           tot_prestamos=tot_prestamos,
-                           usuario=session.get("user_name"))
+                           usuario=session.get("user_name"),
+                           **_dashboard_counts())
 
 # ----------------- Libros -----------------
 @app.get("/libros", endpoint="libros_listar")
 @login_required
 def libros_listar():
-    libros = query_all("""
+    total = safe_count("SELECT COUNT(*) c FROM libros", tables=("libros",))
+    libros = stream_query("""
         SELECT id, titulo, autor, anio_publicacion, genero, isbn,
                numero_copias, copias_disponibles, fecha_registro
         FROM libros
         ORDER BY titulo
-    """)
-    return render_template("libros/listar.html", libros=libros)
+    """, tables=("libros",), max_rows=total)
+    return render_stream("libros/listar.html", libros=libros, total=total)
 
 
 @app.route("/libros/editar/<int:libro_id>", methods=["GET","POST"], endpoint="libros_editar")
@@ -220,28 +445,49 @@ def libros_agregar():
     return render_template("libros/agregar.html")
 
 # ----------------- Prestamos -----------------
+# El historial (activos + archivados) se lee de la vista prestamos_todos si
+# existe (02_prestamos_historico.sql); sin ella no hay archivo y basta prestamos
+_prestamos_source = {"name": None, "checked": 0.0}
+
+def prestamos_source():
+    if _prestamos_source["name"] == "prestamos_todos":
+        return "prestamos_todos"
+    now = time.monotonic()
+    if _prestamos_source["name"] and now - _prestamos_source["checked"] < 60:
+        return _prestamos_source["name"]
+    try:
+        query_one("SELECT 1 AS x FROM prestamos_todos WHERE 1 = 0")
+        name = "prestamos_todos"
+    except oracledb.DatabaseError as e:
+        if e.args[0].code != 942:            # ORA-00942: la vista no existe
+            raise
+        name = "prestamos"
+    _prestamos_source.update(name=name, checked=now)
+    return name
+
 @app.get("/prestamos", endpoint="prestamos_listar")
 @login_required
 def prestamos_listar():
     # Librarian/admins see all préstamos; regular users see only theirs
     prestamos_count = None
+    source = prestamos_source()
     if session.get('user_rol') in ('BIBLIOTECARIO', 'ADMIN'):
         # Try to include optional columns (dias, penalizacion); fallback if columns don't exist
-        if safe_count("SELECT COUNT(*) c FROM prestamos"):
+        if safe_count(f"SELECT COUNT(*) c FROM {source}"):
             try:
-                prestamos = query_all("""
+                prestamos = stream_query(f"""
                     SELECT p.id, u.nombre AS usuario, l.titulo AS libro, l.editorial AS editorial,
                            p.fecha_prestamo, p.fecha_devolucion, p.dias, p.penalizacion, p.estado
-                    FROM prestamos p
+                    FROM {source} p
                     JOIN usuarios u ON p.usuario_id = u.id
                     JOIN libros l ON p.libro_id = l.id
                     ORDER BY p.id DESC
                 """)
             except Exception:
-                prestamos = query_all("""
+                prestamos = stream_query(f"""
                     SELECT p.id, u.nombre AS usuario, l.titulo AS libro, l.editorial AS editorial,
                            p.fecha_prestamo, p.fecha_devolucion, p.estado
-                    FROM prestamos p
+                    FROM {source} p
                     JOIN usuarios u ON p.usuario_id = u.id
                     JOIN libros l ON p.libro_id = l.id
                     ORDER BY p.id DESC
@@ -257,33 +503,35 @@ def prestamos_listar():
         except Exception:
             user_id = session.get('user_id')
         app.logger.debug("prestamos_listar: user_id=%s, user_rol=%s", user_id, session.get('user_rol'))
-        if safe_count("SELECT COUNT(*) c FROM prestamos"):
+        # El historial del usuario incluye los préstamos archivados (vista prestamos_todos)
+        if safe_count(f"SELECT COUNT(*) c FROM {source} WHERE usuario_id=:user_id", {"user_id": user_id}):
+            # Contar préstamos activos del usuario antes de abrir el stream: mientras
+            # se genera la página, la conexión del stream sigue ocupada
+            prestamos_count = safe_count("SELECT COUNT(*) c FROM prestamos WHERE usuario_id=:user_id AND estado='ACTIVO'", {"user_id": user_id})
             try:
-                prestamos = query_all("""
+                prestamos = stream_query(f"""
                     SELECT p.id, u.nombre AS usuario, l.titulo AS libro, l.editorial AS editorial,
                            p.fecha_prestamo, p.fecha_devolucion, p.dias, p.penalizacion, p.estado
-                    FROM prestamos p
+                    FROM {source} p
                     JOIN usuarios u ON p.usuario_id = u.id
                     JOIN libros l ON p.libro_id = l.id
                     WHERE p.usuario_id = :user_id
                     ORDER BY p.id DESC
                 """, {"user_id": user_id})
             except Exception:
-                prestamos = query_all("""
+                prestamos = stream_query(f"""
                     SELECT p.id, u.nombre AS usuario, l.titulo AS libro, l.editorial AS editorial,
                            p.fecha_prestamo, p.fecha_devolucion, p.estado
-                    FROM prestamos p
+                    FROM {source} p
                     JOIN usuarios u ON p.usuario_id = u.id
                     JOIN libros l ON p.libro_id = l.id
                     WHERE p.usuario_id = :user_id
                     ORDER BY p.id DESC
                 """, {"user_id": user_id})
-            # Contar préstamos activos del usuario
-            prestamos_count = safe_count("SELECT COUNT(*) c FROM prestamos WHERE usuario_id=:user_id AND estado='ACTIVO'", {"user_id": user_id})
         else:
             prestamos = []
             prestamos_count = 0
-    return render_template("prestamos/listar.html", prestamos=prestamos, prestamos_count=prestamos_count)
+    return render_stream("prestamos/listar.html", prestamos=prestamos, prestamos_count=prestamos_count)
 
 # NUEVA RUTA — crear préstamo
 @app.route("/prestamos/nuevo", methods=["GET", "POST"], endpoint="prestamos_nuevo")
@@ -353,8 +601,9 @@ def prestamos_nuevo():
         flash("Préstamo registrado correctamente", "success")
         return redirect(url_for("prestamos_listar"))
 
-    usuarios = query_all("SELECT id, nombre FROM usuarios ORDER BY nombre")
-    libros = query_all("SELECT id, titulo, editorial FROM libros WHERE copias_disponibles > 0 ORDER BY titulo")
+    usuarios = query_all("SELECT id, nombre FROM usuarios ORDER BY nombre", tables=("usuarios",))
+    libros = query_all("SELECT id, titulo, editorial FROM libros WHERE copias_disponibles > 0 ORDER BY titulo",
+                       tables=("libros",))
     return render_template("prestamos/nuevo.html", usuarios=usuarios, libros=libros)
 
 
@@ -398,52 +647,441 @@ def reporte_bajo_stock():
         threshold = 2
 
     libros = []
-    if safe_count("SELECT COUNT(*) c FROM libros"):
-        libros = query_all(
+    total = safe_count("SELECT COUNT(*) c FROM libros", tables=("libros",))
+    if total:
+        libros = stream_query(
             """
             SELECT id, titulo, autor, copias_disponibles
             FROM libros
             WHERE copias_disponibles <= :threshold
             ORDER BY copias_disponibles ASC, titulo
             """,
-            {"threshold": threshold}
+            {"threshold": threshold},
+            tables=("libros",),
+            max_rows=total
         )
 
-    return render_template("reportes/bajo_stock.html", libros=libros, threshold=threshold)
+    return render_stream("reportes/bajo_stock.html", libros=libros, threshold=threshold)
+
+
+BAJO_STOCK_CSV_SQL = """
+    SELECT id, titulo, autor, numero_copias, copias_disponibles
+    FROM libros
+    WHERE copias_disponibles <= :threshold
+    ORDER BY copias_disponibles ASC, titulo
+"""
+
+def _build_bajo_stock_csv(conn, params, out, progress):
+    import csv
+    with conn.cursor() as cur:
+        cur.execute("SELECT COUNT(*) FROM libros WHERE copias_disponibles <= :threshold", params)
+        total = cur.fetchone()[0] or 1
+        cur.arraysize = app.config["STREAM_FETCH_SIZE"]
+        cur.execute(BAJO_STOCK_CSV_SQL, params)
+        writer = csv.writer(out)
+        writer.writerow(["id", "titulo", "autor", "numero_copias", "copias_disponibles"])
+        done = 0
+        while True:
+            batch = cur.fetchmany()
+            if not batch:
+                break
+            writer.writerows(batch)
+            done += len(batch)
+            progress(100.0 * done / total)
+
+# La versión de los datos es el último cambio registrado en libros_cambios.
+# Es del catálogo, no de un usuario: lo ve cualquiera con sesión, como la
+# página /reportes/bajo_stock (una exportación de historial iría con per_user=True)
+jobs.register("bajo_stock", _build_bajo_stock_csv,
+              version_sql="SELECT NVL(MAX(seq), 0) FROM libros_cambios")
+jobs.init_app(app, get_conn)
+
+
+@app.cli.command("trabajos")
+def trabajos_command():
+    """Proceso ejecutor de trabajos en segundo plano (uno por despliegue)."""
+    # Este proceso solo necesita una conexión por hilo más la del bucle
+    app.config["DB_POOL_MAX"] = app.config["JOBS_WORKERS"] + 1
+    jobs.run_forever()
 
 
 @app.get('/reportes/bajo_stock/download', endpoint='reporte_bajo_stock_download')
 @login_required
 def reporte_bajo_stock_download():
-    """Download low-stock books as CSV. Accepts ?threshold=NUMBER"""
+    """Download low-stock books as CSV. Accepts ?threshold=NUMBER
+
+    The CSV is produced by a background job; if an up-to-date file already
+    exists it is sent right away, otherwise the user waits on the job page.
+    """
     try:
         threshold = int(request.args.get('threshold', 2))
     except ValueError:
         threshold = 2
 
-    # Fetch rows
-    rows = query_all(
-        "SELECT id, titulo, autor, numero_copias, copias_disponibles FROM libros WHERE copias_disponibles <= :threshold ORDER BY copias_disponibles ASC, titulo",
-        {"threshold": threshold}
-    ) if safe_count("SELECT COUNT(*) c FROM libros") else []
+    try:
+        trabajo = jobs.enqueue("bajo_stock", {"threshold": threshold}, _session_user_id())
+    except jobs.QueueFull:
+        flash("Hay demasiados informes en cola, inténtalo en unos minutos", "warning")
+        return redirect(url_for('reporte_bajo_stock', threshold=threshold))
+    except oracledb.DatabaseError as e:
+        # Sin 01_libros_cambios.sql / 03_trabajos.sql: el CSV se genera en la petición
+        if e.args[0].code != 942:
+            raise
+        app.logger.warning("Trabajos no disponibles (%s); CSV generado en línea", e)
+        return _bajo_stock_csv_inline(threshold)
+    if trabajo["estado"] == "COMPLETADO":
+        return _send_trabajo(trabajo)
+    return redirect(url_for('trabajo_estado', trabajo_id=trabajo["id"]))
 
-    # Build CSV
+def _bajo_stock_csv_inline(threshold):
     from io import StringIO
-    import csv
     si = StringIO()
-    writer = csv.writer(si)
-    writer.writerow(["id", "titulo", "autor", "numero_copias", "copias_disponibles"])
-    for r in rows:
-        writer.writerow([r.get('id'), r.get('titulo'), r.get('autor'), r.get('numero_copias'), r.get('copias_disponibles')])
-
-    output = si.getvalue()
-    from flask import Response
+    with get_conn() as conn:
+        _build_bajo_stock_csv(conn, {"threshold": threshold}, si, lambda pct: None)
     headers = {
         'Content-Type': 'text/csv; charset=utf-8',
         'Content-Disposition': f'attachment; filename=low_stock_threshold_{threshold}.csv'
     }
-    return Response(output, headers=headers)
+    return app.response_class(si.getvalue(), headers=headers)
+
+# ----------------- Trabajos en segundo plano -----------------
+def _trabajo_or_404(trabajo_id):
+    # Un trabajo ajeno se trata como inexistente para no revelar los ids
+    trabajo = jobs.get(trabajo_id)
+    if not trabajo or not jobs.can_access(trabajo, _session_user_id(), session.get("user_rol")):
+        abort(404)
+    return trabajo
+
+def _send_trabajo(trabajo):
+    path = jobs.file_path(trabajo)
+    if not path or not os.path.exists(path):
+        abort(410)
+    return send_file(path, as_attachment=True, download_name=os.path.basename(path))
+
+@app.get("/trabajos/<int:trabajo_id>", endpoint="trabajo_estado")
+@login_required
+def trabajo_estado(trabajo_id):
+    return render_template("reportes/trabajo.html", trabajo=_trabajo_or_404(trabajo_id))
+
+@app.get("/trabajos/<int:trabajo_id>/descargar", endpoint="trabajo_descargar")
+@login_required
+def trabajo_descargar(trabajo_id):
+    trabajo = _trabajo_or_404(trabajo_id)
+    if trabajo["estado"] != "COMPLETADO":
+        return redirect(url_for("trabajo_estado", trabajo_id=trabajo_id))
+    return _send_trabajo(trabajo)
+
+# ----------------- API v1 (JSON) -----------------
+# Campos expuestos por la API: nombre público -> expresión SQL. ``fields=``
+# selecciona un subconjunto y solo esas columnas entran en el SELECT.
+API_LIBROS_FIELDS = {
+    "id": "id", "titulo": "titulo", "autor": "autor", "anio_publicacion": "anio_publicacion",
+    "genero": "genero", "isbn": "isbn", "numero_copias": "numero_copias",
+    "copias_disponibles": "copias_disponibles", "fecha_registro": "fecha_registro",
+    "fecha_modificacion": "fecha_modificacion",
+}
+# fecha_modificacion requiere 01_libros_cambios.sql: solo si se pide en fields=
+API_LIBROS_DEFAULT = [f for f in API_LIBROS_FIELDS if f != "fecha_modificacion"]
+API_PRESTAMOS_FIELDS = {
+    "id": "p.id", "usuario_id": "p.usuario_id", "usuario": "u.nombre", "libro_id": "p.libro_id",
+    "libro": "l.titulo", "editorial": "l.editorial", "fecha_prestamo": "p.fecha_prestamo",
+    "fecha_devolucion": "p.fecha_devolucion", "estado": "p.estado",
+    # Columnas opcionales: solo existen en algunas instalaciones
+    "dias": "p.dias", "penalizacion": "p.penalizacion",
+}
+API_PRESTAMOS_DEFAULT = [f for f in API_PRESTAMOS_FIELDS if f not in ("dias", "penalizacion")]
+
+
+class ApiError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+@app.errorhandler(ApiError)
+def _api_error(e):
+    return api_response({"error": e.message}, status=e.status)
+
+
+def _json_default(o):
+    if hasattr(o, "isoformat"):
+        return o.isoformat()
+    return str(o)
+
+
+def api_response(payload, status=200):
+    """Serializa ``payload`` de forma compacta y lo comprime con gzip si compensa."""
+    if orjson is not None:
+        body = orjson.dumps(payload, default=_json_default)
+    else:
+        body = json.dumps(payload, default=_json_default, ensure_ascii=False,
+                          separators=(",", ":")).encode("utf-8")
+    headers = {"Vary": "Accept-Encoding"}
+    if (len(body) >= app.config["API_GZIP_MIN_BYTES"]
+            and request.accept_encodings.quality("gzip") > 0):
+        body = gzip.compress(body, compresslevel=app.config["API_GZIP_LEVEL"])
+        headers["Content-Encoding"] = "gzip"
+    return app.response_class(body, status=status, headers=headers, mimetype="application/json")
+
+
+def _api_fields(allowed, default=None):
+    """Campos pedidos en ``?fields=a,b``; ``id`` se incluye siempre (lo usa el cursor)."""
+    raw = request.args.get("fields")
+    if not raw:
+        fields = list(default or allowed)
+    else:
+        fields = [f.strip() for f in raw.split(",") if f.strip()]
+        unknown = [f for f in fields if f not in allowed]
+        if unknown:
+            raise ApiError(f"Campos desconocidos: {', '.join(unknown)}")
+    if "id" not in fields:
+        fields.insert(0, "id")
+    return fields
+
+
+def _api_select(allowed, fields):
+    return ", ".join(f"{allowed[f]} AS {f}" for f in fields)
+
+
+def _api_limit():
+    try:
+        limit = int(request.args.get("limit", app.config["API_PAGE_SIZE"]))
+    except ValueError:
+        raise ApiError("limit debe ser un número entero")
+    return max(1, min(limit, app.config["API_MAX_PAGE_SIZE"]))
+
+
+def _encode_cursor(values):
+    raw = json.dumps(values, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _decode_cursor(size, arg="cursor"):
+    """Valores del cursor ``?cursor=`` (lista de ``size`` enteros) o None."""
+    token = request.args.get(arg)
+    if not token:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        if len(values) != size or not all(isinstance(v, int) for v in values):
+            raise ValueError(token)
+    except (ValueError, TypeError):
+        raise ApiError(f"{arg} inválido")
+    return values
+
+
+def _api_page(rows, limit, fields, cursor_keys):
+    """Recorta la página (se piden ``limit + 1`` filas) y calcula el siguiente cursor."""
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = None
+    if has_more:
+        last = rows[-1]
+        next_cursor = _encode_cursor([last[k] for k in cursor_keys])
+    data = [{f: r.get(f) for f in fields} for r in rows]
+    return {"data": data, "next_cursor": next_cursor}
+
+
+@app.get("/api/v1/dashboard", endpoint="api_dashboard")
+@login_required
+def api_dashboard():
+    return api_response(_dashboard_counts())
+
+
+def _api_libros_query(sql, params):
+    try:
+        return query_all(sql, params, tables=("libros",))
+    except oracledb.DatabaseError as e:
+        if e.args[0].code != 904:            # ORA-00904: columna inexistente
+            raise
+        app.logger.debug("api libros: columna no disponible: %s", e)
+        raise ApiError("fecha_modificacion no disponible en esta instalación")
+
+
+@app.get("/api/v1/libros", endpoint="api_libros")
+@login_required
+def api_libros():
+    fields = _api_fields(API_LIBROS_FIELDS, API_LIBROS_DEFAULT)
+    limit = _api_limit()
+    after = _decode_cursor(1)
+    rows = _api_libros_query(f"""
+        SELECT {_api_select(API_LIBROS_FIELDS, fields)}
+        FROM libros
+        WHERE id > :after_id
+        ORDER BY id
+        FETCH FIRST :n ROWS ONLY
+    """, {"after_id": after[0] if after else 0, "n": limit + 1})
+    return api_response(_api_page(rows, limit, fields, ["id"]))
+
+
+@app.get("/api/v1/libros/cambios", endpoint="api_libros_cambios")
+@login_required
+def api_libros_cambios():
+    """Cambios del catálogo posteriores a ``?since=<token>`` (sin token: todo).
+
+    Devuelve, por libro, su estado actual ("upsert") o una marca de borrado
+    ("delete"), ordenados por su último cambio. ``next_token`` se guarda y se
+    envía en la siguiente llamada; mientras ``has_more`` sea true hay más
+    páginas. Requiere database/sql/01_libros_cambios.sql.
+
+    La secuencia se asigna al ejecutar el DML, pero el cambio solo es visible
+    al confirmar, así que un número bajo puede aparecer después de uno alto.
+    Por eso solo se entregan cambios anteriores al primero registrado en los
+    últimos CHANGES_SAFETY_LAG_S segundos: no se pierde ningún cambio cuya
+    transacción confirme dentro de ese margen (en esta aplicación cada
+    sentencia confirma al momento). Los cambios recientes salen en la
+    siguiente llamada.
+    """
+    fields = _api_fields(API_LIBROS_FIELDS)
+    limit = _api_limit()
+    since = (_decode_cursor(1, "since") or [0])[0]
+    # Primer cambio aún dentro del margen de seguridad (None: ninguno)
+    horizon = query_one("""
+        SELECT MIN(seq) AS seq
+        FROM libros_cambios
+        WHERE seq > :since
+          -- fecha es TIMESTAMP sin zona (hora del servidor): comparar con
+          -- SYSTIMESTAMP la convertiría con la zona horaria de la sesión
+          AND fecha >= CAST(SYSTIMESTAMP AS TIMESTAMP) - NUMTODSINTERVAL(:lag, 'SECOND')
+    """, {"since": since, "lag": app.config["CHANGES_SAFETY_LAG_S"]})["seq"]
+    select = ", ".join(f"l.{API_LIBROS_FIELDS[f]} AS {f}" for f in fields)
+    # Un libro con varios cambios aparece una sola vez, en la posición de su
+    # último cambio; si ya no existe en LIBROS es un borrado
+    rows = query_all(f"""
+        SELECT c.seq AS cambio_seq, c.libro_id AS cambio_libro_id, {select}
+        FROM (
+            SELECT libro_id, MAX(seq) AS seq
+            FROM libros_cambios
+            WHERE seq > :since
+              AND (:horizon IS NULL OR seq < :horizon)
+            GROUP BY libro_id
+            ORDER BY MAX(seq)
+            FETCH FIRST :n ROWS ONLY
+        ) c
+        LEFT JOIN libros l ON l.id = c.libro_id
+        ORDER BY c.seq
+    """, {"since": since, "horizon": horizon, "n": limit + 1})
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    changes = []
+    for r in rows:
+        if r.get("id") is None:
+            changes.append({"op": "delete", "id": r["cambio_libro_id"]})
+        else:
+            changes.append({"op": "upsert", "id": r["cambio_libro_id"],
+                            "libro": {f: r.get(f) for f in fields}})
+    last_seq = rows[-1]["cambio_seq"] if rows else since
+    return api_response({"changes": changes, "next_token": _encode_cursor([last_seq]),
+                         "has_more": has_more})
+
+
+@app.get("/api/v1/prestamos", endpoint="api_prestamos")
+@login_required
+def api_prestamos():
+    # Igual que prestamos_listar: bibliotecario/admin ven todo, el resto solo lo suyo
+    fields = _api_fields(API_PRESTAMOS_FIELDS, API_PRESTAMOS_DEFAULT)
+    limit = _api_limit()
+    before = _decode_cursor(1)
+    params = {"n": limit + 1}
+    where = []
+    if before:
+        where.append("p.id < :before_id")
+        params["before_id"] = before[0]
+    # Historial completo, incluidos los préstamos archivados
+    source = prestamos_source()
+    if session.get("user_rol") not in ("BIBLIOTECARIO", "ADMIN"):
+        where.append("p.usuario_id = :user_id")
+        params["user_id"] = _session_user_id()
+    try:
+        rows = query_all(f"""
+            SELECT {_api_select(API_PRESTAMOS_FIELDS, fields)}
+            FROM {source} p
+            JOIN usuarios u ON p.usuario_id = u.id
+            JOIN libros l ON p.libro_id = l.id
+            {"WHERE " + " AND ".join(where) if where else ""}
+            ORDER BY p.id DESC
+            FETCH FIRST :n ROWS ONLY
+        """, params)
+    except oracledb.DatabaseError as e:
+        # Solo las columnas opcionales (dias, penalizacion) son culpa de la petición
+        optional = [f for f in fields if f in ("dias", "penalizacion")]
+        if e.args[0].code != 904 or not optional:      # ORA-00904: columna inexistente
+            raise
+        app.logger.debug("api_prestamos: columnas opcionales no disponibles: %s", e)
+        raise ApiError(f"Campos no disponibles en esta instalación: {', '.join(optional)}")
+    return api_response(_api_page(rows, limit, fields, ["id"]))
+
+
+@app.get("/api/v1/reportes/bajo_stock", endpoint="api_reporte_bajo_stock")
+@login_required
+def api_reporte_bajo_stock():
+    try:
+        threshold = int(request.args.get("threshold", 2))
+    except ValueError:
+        raise ApiError("threshold debe ser un número entero")
+    fields = _api_fields(API_LIBROS_FIELDS, API_LIBROS_DEFAULT)
+    limit = _api_limit()
+    after = _decode_cursor(2)
+    params = {"threshold": threshold, "n": limit + 1}
+    keyset = ""
+    if after:
+        keyset = "AND (copias_disponibles > :after_disp OR (copias_disponibles = :after_disp AND id > :after_id))"
+        params.update(after_disp=after[0], after_id=after[1])
+    select = _api_select(API_LIBROS_FIELDS, fields)
+    if "copias_disponibles" not in fields:
+        select += ", copias_disponibles"
+    rows = _api_libros_query(f"""
+        SELECT {select}
+        FROM libros
+        WHERE copias_disponibles <= :threshold {keyset}
+        ORDER BY copias_disponibles ASC, id
+        FETCH FIRST :n ROWS ONLY
+    """, params)
+    page = _api_page(rows, limit, fields, ["copias_disponibles", "id"])
+    page["threshold"] = threshold
+    return api_response(page)
+
+@app.post("/api/v1/trabajos", endpoint="api_trabajos_crear")
+@login_required
+def api_trabajos_crear():
+    """Encola un informe: {"tipo": "bajo_stock", "parametros": {"threshold": 2}}."""
+    body = request.get_json(silent=True) or {}
+    tipo = body.get("tipo")
+    if tipo != "bajo_stock":
+        raise ApiError("tipo de informe desconocido")
+    if not jobs.allowed(tipo, session.get("user_rol")):
+        raise ApiError("No autorizado", status=403)
+    try:
+        params = {"threshold": int((body.get("parametros") or {}).get("threshold", 2))}
+    except (TypeError, ValueError):
+        raise ApiError("threshold debe ser un número entero")
+    try:
+        trabajo = jobs.enqueue(tipo, params, _session_user_id())
+    except jobs.QueueFull:
+        raise ApiError("Cola de trabajos llena", status=503)
+    except oracledb.DatabaseError as e:
+        if e.args[0].code != 942:
+            raise
+        raise ApiError("Informes en segundo plano no disponibles", status=503)
+    return api_response(_api_trabajo(trabajo), status=202 if trabajo["estado"] != "COMPLETADO" else 200)
+
+
+def _api_trabajo(trabajo):
+    data = {k: trabajo[k] for k in ("id", "tipo", "estado", "progreso", "error",
+                                    "fecha_creacion", "fecha_inicio", "fecha_fin")}
+    data["descarga"] = (url_for("trabajo_descargar", trabajo_id=trabajo["id"])
+                        if trabajo["estado"] == "COMPLETADO" else None)
+    return data
+
+
+@app.get("/api/v1/trabajos/<int:trabajo_id>", endpoint="api_trabajo")
+@login_required
+def api_trabajo(trabajo_id):
+    return api_response(_api_trabajo(_trabajo_or_404(trabajo_id)))
 
 # ----------------- Fin -----------------
-# Ejecuta:
+# Ejecuta (desarrollo):
 # python -m flask --app myapp:app run --debug -p 5050
+# Producción (varios workers, ver gunicorn.conf.py):
+# gunicorn -c gunicorn.conf.py myapp:app
@@ -0,0 +1,235 @@
+# profiling.py
+"""Perfilado opcional de peticiones lentas.
+
+Se activa con PROFILE_SAMPLE_RATE (fracción de peticiones a perfilar) y/o
+PROFILE_SLOW_MS (solo se guardan las peticiones que superan ese tiempo). Si
+ambos valen 0, ``init_app`` no registra nada y ``traced_execute`` se reduce a
+``cur.execute``.
+
+Solo sirve con hilos (servidor de desarrollo o gunicorn gthread): los perfiles
+se asocian al hilo de la petición y las pilas salen de ``sys._current_frames``.
+Con workers gevent varias peticiones comparten hilo, así que ``init_app`` no lo
+activa.
+
+Por cada petición perfilada se escriben en PROFILE_DIR dos ficheros:
+``<nombre>.folded`` (pilas en formato "collapsed", válido para flamegraph.pl o
+speedscope) y ``<nombre>.json`` (datos de la petición y cronología SQL, con el
+plan de ejecución DBMS_XPLAN y los binds de las sentencias lentas).
+"""
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+import logging
+
+logger = logging.getLogger(__name__)
+
+# thread id -> RequestProfile de las peticiones en curso que se están perfilando
+_active = {}
+_sampler = None
+_sampler_lock = threading.Lock()
+_settings = {}
+
+
+class RequestProfile:
+    def __init__(self, method, path, sampled):
+        self.method = method
+        self.path = path
+        self.sampled = sampled
+        self.started = time.perf_counter()
+        self.started_at = datetime.now()
+        self.stacks = Counter()
+        self.sql = []
+        self.cursors = {}   # id(cursor) -> entrada de su última sentencia
+
+
+class _Sampler(threading.Thread):
+    """Hilo único que toma muestras de la pila de los hilos perfilados."""
+
+    def __init__(self, interval):
+        super().__init__(name="profiling-sampler", daemon=True)
+        self.interval = interval
+        self.pid = os.getpid()
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            if not _active:
+                continue
+            frames = sys._current_frames()
+            for tid, prof in list(_active.items()):
+                frame = frames.get(tid)
+                if frame is not None:
+                    prof.stacks[_collapse(frame)] += 1
+
+
+def _collapse(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+def _ensure_sampler():
+    global _sampler
+    # Tras un fork el hilo no existe en el hijo: se arranca de nuevo
+    if _sampler is not None and _sampler.pid == os.getpid():
+        return
+    with _sampler_lock:
+        if _sampler is None or _sampler.pid != os.getpid():
+            _sampler = _Sampler(_settings["interval"])
+            _sampler.start()
+
+
+def init_app(app):
+    sample_rate = float(app.config.get("PROFILE_SAMPLE_RATE") or 0)
+    slow_ms = float(app.config.get("PROFILE_SLOW_MS") or 0)
+    if sample_rate <= 0 and slow_ms <= 0:
+        return
+    if app.config.get("WEB_WORKER_CLASS") == "gevent":
+        logger.warning("Perfilado desactivado: no es compatible con workers gevent")
+        return
+
+    _settings.update(
+        sample_rate=sample_rate,
+        slow_ms=slow_ms,
+        sql_slow_ms=float(app.config.get("PROFILE_SQL_SLOW_MS") or 0),
+        interval=float(app.config.get("PROFILE_INTERVAL_MS") or 5) / 1000.0,
+        directory=app.config.get("PROFILE_DIR") or "profiles",
+    )
+    os.makedirs(_settings["directory"], exist_ok=True)
+    logger.info("Perfilado activo: sample_rate=%s slow_ms=%s dir=%s",
+                sample_rate, slow_ms, _settings["directory"])
+
+    from flask import request
+
+    @app.before_request
+    def _profile_start():
+        sampled = random.random() < _settings["sample_rate"]
+        if not sampled and not _settings["slow_ms"]:
+            return
+        _ensure_sampler()
+        _active[threading.get_ident()] = RequestProfile(request.method, request.path, sampled)
+
+    @app.teardown_request
+    def _profile_stop(exc=None):
+        prof = _active.pop(threading.get_ident(), None)
+        if prof is None:
+            return
+        elapsed_ms = (time.perf_counter() - prof.started) * 1000
+        if prof.sampled or elapsed_ms >= _settings["slow_ms"]:
+            try:
+                _write_report(prof, elapsed_ms, exc)
+            except OSError as e:
+                logger.warning("No se pudo escribir el perfil de %s: %s", prof.path, e)
+
+
+def traced_execute(cur, sql, params=None):
+    """Equivalente a ``cur.execute`` que anota la sentencia en el perfil en curso."""
+    if not _active:
+        return cur.execute(sql, params or {})
+    prof = _active.get(threading.get_ident())
+    if prof is None:
+        return cur.execute(sql, params or {})
+
+    offset_ms = (time.perf_counter() - prof.started) * 1000
+    t0 = time.perf_counter()
+    try:
+        return cur.execute(sql, params or {})
+    finally:
+        elapsed_ms = (time.perf_counter() - t0) * 1000
+        entry = {
+            "offset_ms": round(offset_ms, 3),
+            "elapsed_ms": round(elapsed_ms, 3),
+            "fetch_ms": 0.0,
+            "rows": 0,
+            "sql": " ".join(sql.split()),
+            "binds": params or {},
+        }
+        if _settings["sql_slow_ms"] and elapsed_ms >= _settings["sql_slow_ms"]:
+            entry["plan"] = _capture_plan(cur.connection, sql)
+        prof.sql.append(entry)
+        prof.cursors[id(cur)] = entry
+
+
+def traced_fetch(cur, method="fetchall", *args):
+    """Equivalente a ``cur.<method>(*args)`` que suma el tiempo de lectura a su sentencia.
+
+    En consultas que se leen por lotes (stream_query) la mayor parte del
+    tiempo está en los fetch, no en ``execute``.
+    """
+    fetch = getattr(cur, method)
+    prof = _active.get(threading.get_ident()) if _active else None
+    entry = prof.cursors.get(id(cur)) if prof is not None else None
+    if entry is None:
+        return fetch(*args)
+    t0 = time.perf_counter()
+    result = fetch(*args)
+    entry["fetch_ms"] = round(entry["fetch_ms"] + (time.perf_counter() - t0) * 1000, 3)
+    if isinstance(result, list):
+        entry["rows"] += len(result)
+    elif result is not None:
+        entry["rows"] += 1
+    return result
+
+
+def _capture_plan(conn, sql):
+    """Plan de la última sentencia de la sesión (con binds reales si es posible)."""
+    try:
+        with conn.cursor() as pc:
+            pc.execute("""
+                SELECT plan_table_output
+                FROM TABLE(DBMS_XPLAN.DISPLAY_CURSOR(NULL, NULL, 'TYPICAL +PEEKED_BINDS'))
+            """)
+            lines = [r[0] for r in pc.fetchall()]
+            if lines and not any("cannot be found" in (l or "") for l in lines):
+                return lines
+    except Exception as e:
+        # Sin acceso a V$SQL_PLAN: se recurre a EXPLAIN PLAN (sin valores de binds)
+        logger.debug("DISPLAY_CURSOR no disponible: %s", e)
+
+    statement_id = f"prof_{threading.get_ident()}"[:30]
+    try:
+        with conn.cursor() as pc:
+            pc.execute(f"EXPLAIN PLAN SET STATEMENT_ID = '{statement_id}' FOR {sql}")
+            pc.execute("""
+                SELECT plan_table_output
+                FROM TABLE(DBMS_XPLAN.DISPLAY('PLAN_TABLE', :sid, 'TYPICAL'))
+            """, {"sid": statement_id})
+            return [r[0] for r in pc.fetchall()]
+    except Exception as e:
+        logger.debug("No se pudo obtener el plan de ejecución: %s", e)
+        return None
+
+
+def _write_report(prof, elapsed_ms, exc):
+    slug = re.sub(r"[^A-Za-z0-9]+", "_", prof.path).strip("_") or "root"
+    name = f"{prof.started_at:%Y%m%d_%H%M%S_%f}_{prof.method}_{slug}_{int(elapsed_ms)}ms"
+    base = os.path.join(_settings["directory"], name)
+
+    with open(base + ".folded", "w", encoding="utf-8") as fh:
+        for stack, count in prof.stacks.most_common():
+            fh.write(f"{stack} {count}\n")
+
+    report = {
+        "method": prof.method,
+        "path": prof.path,
+        "started_at": prof.started_at.isoformat(),
+        "elapsed_ms": round(elapsed_ms, 3),
+        "sampled": prof.sampled,
+        "error": repr(exc) if exc else None,
+        "samples": sum(prof.stacks.values()),
+        "sample_interval_ms": _settings["interval"] * 1000,
+        "sql_total_ms": round(sum(s["elapsed_ms"] + s["fetch_ms"] for s in prof.sql), 3),
+        "sql": prof.sql,
+    }
+    with open(base + ".json", "w", encoding="utf-8") as fh:
+        json.dump(report, fh, indent=2, ensure_ascii=False, default=str)
+    logger.info("Perfil guardado: %s (%.1f ms, %d sentencias)", base, elapsed_ms, len(prof.sql))
@@ -0,0 +1,57 @@
+import base64
+import json
+import os
+
+import pytest
+
+import myapp
+from myapp import ApiError, _decode_cursor, _encode_cursor, app
+
+
+def decode(query, size, arg="cursor"):
+    with app.test_request_context(query):
+        return _decode_cursor(size, arg)
+
+
+@pytest.mark.parametrize("values", [[0], [42], [3, 1578], [2 ** 40, 7]])
+def test_round_trip(values):
+    token = _encode_cursor(values)
+    assert "=" not in token
+    assert decode(f"/?cursor={token}", len(values)) == values
+
+
+def test_custom_argument_name():
+    token = _encode_cursor([9])
+    assert decode(f"/?since={token}", 1, arg="since") == [9]
+    assert decode(f"/?cursor={token}", 1, arg="since") is None
+
+
+def test_missing_or_empty_token():
+    assert decode("/", 1) is None
+    assert decode("/?cursor=", 1) is None
+
+
+@pytest.mark.parametrize("token", [
+    "no-es-base64!",
+    base64.urlsafe_b64encode(b"no json").decode().rstrip("="),
+    _encode_cursor([1, 2]),                  # tamaño incorrecto
+    _encode_cursor(["1"]),                   # no entero
+    _encode_cursor([1.5]),
+    base64.urlsafe_b64encode(json.dumps({"id": 1}).encode()).decode().rstrip("="),
+])
+def test_invalid_token(token):
+    with pytest.raises(ApiError) as exc:
+        decode(f"/?cursor={token}", 1)
+    assert exc.value.status == 400
+
+
+def test_invalid_token_returns_json_400(monkeypatch):
+    # El cursor se valida antes de tocar la base de datos: sin pool ni ejecutor
+    monkeypatch.setitem(myapp._worker, "pid", os.getpid())
+    client = app.test_client()
+    with client.session_transaction() as s:
+        s["user_id"] = 1
+        s["user_rol"] = "ADMIN"
+    resp = client.get("/api/v1/libros?cursor=xyz")
+    assert resp.status_code == 400
+    assert resp.get_json() == {"error": "cursor inválido"}
@@ -0,0 +1,188 @@
+import threading
+import time
+
+import pytest
+
+from database import cache as cache_module
+from database.cache import QueryCache, tables_written
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Reloj controlado para las caducidades (TTL) de la caché."""
+    now = [1000.0]
+    monkeypatch.setattr(cache_module.time, "monotonic", lambda: now[0])
+    return now
+
+
+def counter(value="v"):
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return value
+    return compute, calls
+
+
+def test_tables_written():
+    assert tables_written("INSERT INTO libros (titulo) VALUES (:t)") == {"libros"}
+    assert tables_written("  update LIBROS set x = 1") == {"libros"}
+    assert tables_written('DELETE FROM "SYSTEM"."PRESTAMOS" WHERE id = :id') == {"prestamos"}
+    assert tables_written("MERGE INTO usuarios u USING dual ON (1 = 1)") == {"usuarios"}
+    assert tables_written("SELECT * FROM libros") == set()
+    assert tables_written(None) == set()
+
+
+def test_make_key_normalizes_whitespace_and_bind_order():
+    a = QueryCache.make_key("SELECT *\n  FROM libros WHERE id = :id", {"id": 1, "b": 2})
+    b = QueryCache.make_key("SELECT * FROM libros WHERE id = :id", {"b": 2, "id": 1})
+    assert a == b
+
+
+def test_hit_after_miss():
+    qc = QueryCache()
+    compute, calls = counter()
+    assert qc.get_or_compute("k", ("libros",), compute) == "v"
+    assert qc.get_or_compute("k", ("libros",), compute) == "v"
+    assert len(calls) == 1
+    assert qc.stats()["hits"] == 1 and qc.stats()["misses"] == 1
+
+
+def test_disabled_always_computes():
+    qc = QueryCache(enabled=False)
+    compute, calls = counter()
+    qc.get_or_compute("k", ("libros",), compute)
+    qc.get_or_compute("k", ("libros",), compute)
+    assert len(calls) == 2
+    assert qc.stats()["entries"] == 0
+
+
+def test_ttl_expiry(clock):
+    qc = QueryCache(ttl=30)
+    compute, calls = counter()
+    qc.get_or_compute("k", ("libros",), compute)
+    clock[0] += 29
+    qc.get_or_compute("k", ("libros",), compute)
+    assert len(calls) == 1
+    clock[0] += 2
+    qc.get_or_compute("k", ("libros",), compute)
+    assert len(calls) == 2
+
+
+def test_lru_eviction():
+    qc = QueryCache(max_entries=2)
+    compute, calls = counter()
+    qc.get_or_compute("a", ("t",), compute)
+    qc.get_or_compute("b", ("t",), compute)
+    qc.get_or_compute("a", ("t",), compute)      # "a" pasa a ser la más reciente
+    qc.get_or_compute("c", ("t",), compute)      # expulsa "b"
+    assert len(calls) == 3
+    qc.get_or_compute("a", ("t",), compute)
+    assert len(calls) == 3
+    qc.get_or_compute("b", ("t",), compute)
+    assert len(calls) == 4
+    assert qc.stats()["entries"] == 2
+
+
+def test_invalidate_only_drops_entries_of_that_table():
+    qc = QueryCache()
+    compute, calls = counter()
+    qc.get_or_compute("libros", ("libros",), compute)
+    qc.get_or_compute("usuarios", ("usuarios",), compute)
+    qc.get_or_compute("join", ("libros", "usuarios"), compute)
+    qc.invalidate("LIBROS")
+    assert qc.stats()["entries"] == 1
+    qc.get_or_compute("usuarios", ("usuarios",), compute)
+    assert len(calls) == 3
+
+
+def test_write_during_compute_is_not_stored():
+    qc = QueryCache()
+
+    def compute():
+        qc.invalidate("libros")      # otra petición escribe mientras se lee
+        return "viejo"
+
+    assert qc.get_or_compute("k", ("libros",), compute) == "viejo"
+    assert qc.stats()["entries"] == 0
+
+
+def test_clear_also_discards_in_flight_results():
+    qc = QueryCache()
+
+    def compute():
+        qc.clear()
+        return "viejo"
+
+    qc.get_or_compute("otra", ("libros",), lambda: 1)
+    qc.get_or_compute("k", ("libros",), compute)
+    assert qc.stats()["entries"] == 0
+
+
+def test_stampede_computes_once():
+    qc = QueryCache()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "v"
+
+    results = []
+    first = threading.Thread(target=lambda: results.append(qc.get_or_compute("k", ("t",), compute)))
+    first.start()
+    assert started.wait(5)
+    others = [threading.Thread(target=lambda: results.append(qc.get_or_compute("k", ("t",), compute)))
+              for _ in range(5)]
+    for t in others:
+        t.start()
+    time.sleep(0.05)
+    release.set()
+    for t in [first] + others:
+        t.join(5)
+    assert len(calls) == 1
+    assert results == ["v"] * 6
+
+
+def test_failed_compute_releases_waiters():
+    qc = QueryCache()
+
+    def boom():
+        raise RuntimeError("ORA-03113")
+
+    with pytest.raises(RuntimeError):
+        qc.get_or_compute("k", ("t",), boom)
+    compute, calls = counter()
+    assert qc.get_or_compute("k", ("t",), compute) == "v"
+    assert len(calls) == 1
+
+
+def test_version_change_invalidates():
+    qc = QueryCache()
+    version = [1]
+    qc.version_fn = lambda tables: (version[0],)
+    compute, calls = counter()
+    qc.get_or_compute("k", ("libros",), compute)
+    qc.get_or_compute("k", ("libros",), compute)
+    assert len(calls) == 1
+    version[0] = 2                   # escritura en otro proceso
+    qc.get_or_compute("k", ("libros",), compute)
+    assert len(calls) == 2
+    qc.get_or_compute("k", ("libros",), compute)
+    assert len(calls) == 2
+
+
+def test_version_failure_bypasses_cache():
+    qc = QueryCache()
+
+    def version_fn(tables):
+        raise LookupError("sin libros_cambios")
+
+    qc.version_fn = version_fn
+    compute, calls = counter()
+    qc.get_or_compute("k", ("libros",), compute)
+    qc.get_or_compute("k", ("libros",), compute)
+    assert len(calls) == 2
+    assert qc.stats() == {"entries": 0, "hits": 0, "misses": 0, "hit_ratio": 0.0}